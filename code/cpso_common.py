@@ -0,0 +1,27 @@
+"""
+Helpers shared by the CPSO scraper scripts.
+"""
+
+def coerce_count(value):
+    """
+    Convert a scraped total count to an int
+    
+    Args:
+        value: The 'totalcount' value of a search result
+        
+    Returns:
+        The count as an int, or 0 if it is missing or not a whole number
+    """
+    if isinstance(value, bool):
+        return 0
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        # Keeps signed values such as the "-1" capped marker
+        try:
+            return int(value)
+        except ValueError:
+            return 0
+    return 0
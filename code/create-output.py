@@ -1,48 +1,110 @@
 #!/usr/bin/env python3
-import re
 import os
 import sys
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from tqdm import tqdm
+import numpy as np
 import pandas as pd
 import glob
 import json
 
+from cpso_common import coerce_count
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Arrow-backed dtypes (dtype_backend='pyarrow') need pandas 2.0 or later
+HAS_ARROW_DTYPES = HAS_PYARROW and int(pd.__version__.split('.')[0]) >= 2
+
 # Directory structure constants
 DATA_DIR = "data"
 RESULTS_DIR = "results"
 
-def format_phone(number):
+def format_phone(numbers):
     """
-    Clean and format a phone number
+    Clean and format a column of phone numbers
     
     Args:
-        number: The phone number to format
+        numbers: pandas Series of phone numbers to format
         
     Returns:
-        A formatted phone number string or None if invalid
+        A Series of formatted phone number strings, with NA for invalid numbers
     """
     # Remove all non-digit characters
-    digits = re.sub(r'\D', '', str(number))
+    digits = numbers.astype('string').str.replace(r'\D', '', regex=True)
     
     # If it has exactly 10 digits, format it
-    if len(digits) == 10:
-        return f"({digits[:3]}) {digits[3:6]}-{digits[6:]}"
+    formatted = '(' + digits.str[:3] + ') ' + digits.str[3:6] + '-' + digits.str[6:]
+    valid = (digits.str.len() == 10).fillna(False)
+    return formatted.where(valid, pd.NA)  # NA for invalid phone numbers
+
+def save_dataframe(df, path, output_format="csv"):
+    """
+    Save a DataFrame in the requested format
+    
+    Args:
+        df: DataFrame to save
+        path: Path to the output file
+        output_format: One of "csv", "parquet" or "feather"
+    """
+    if output_format == "csv":
+        # Write in chunks to keep memory bounded on large outputs
+        df.to_csv(path, index=False, chunksize=50_000)
+    elif output_format == "parquet":
+        df.to_parquet(path, index=False, compression="zstd")
+    elif output_format == "feather":
+        # Feather requires a default index
+        df.reset_index(drop=True).to_feather(path)
     else:
-        return None  # Return None for invalid phone numbers
+        raise ValueError(f"Invalid output format: {output_format}. Must be 'csv', 'parquet' or 'feather'.")
 
-def process_data(input_pattern=None, output_dir=None):
+def _parse_one(file):
     """
-    Process JSON files from scraping results and generate summary and detail CSVs
+    Parse a single scrape result file
     
     Args:
-        input_pattern: Glob pattern to find input JSON files
-        output_dir: Directory where output CSV files will be saved
+        file: Path to the JSON file
+        
+    Returns:
+        Tuple of ((postal code, total count), list of doctor record dicts).
+        Both are None if the file could not be processed.
     """
-    # Create output directory if it doesn't exist
-    if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    try:
+        with open(file, 'rb') as f:
+            data = orjson.loads(f.read()) if HAS_ORJSON else json.load(f)
+        
+        # Summary info
+        summary_row = (data.get('postal_code', 'unknown'), coerce_count(data.get('totalcount')))
+        
+        # Detail info
+        return summary_row, data.get('results') or []
+    except Exception as e:
+        print(f"Error processing file {file}: {e}")
+        return None, None
+
+def load_json_files(input_pattern=None, workers=None):
+    """
+    Load scrape results from one JSON file per search
     
+    Args:
+        input_pattern: Glob pattern to find input JSON files
+        workers: Number of processes used to parse files (defaults to the CPU count)
+        
+    Returns:
+        Tuple of (summary DataFrame, details DataFrame), or (None, None) if no
+        files were found
+    """
     # Use default pattern if none provided
     if not input_pattern:
         input_pattern = os.path.join(DATA_DIR, "*", "raw", "*.json")
@@ -57,85 +119,149 @@ def process_data(input_pattern=None, output_dir=None):
     
     if not files:
         print(f"No files found matching pattern: {input_pattern}")
-        return
+        return None, None
     
     print(f"Found {len(files)} files to process")
     
-    summary_rows = []
+    # Summary columns and detail records of all files, turned into DataFrames at the end
+    postal_codes = []
+    totalcounts = []
     detail_rows = []
 
-    # Loop through each file
-    for file in tqdm(files):
-        try:
-            with open(file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-                # Summary info
-                summary_rows.append({
-                    'postal_code': data.get('postal_code', 'unknown'),
-                    'totalcount': data.get('totalcount', 0)
-                })
-                
-                # Detail info
-                if data.get('results'):  # Only if there are results
-                    detail_rows.extend(data['results'])
-        except Exception as e:
-            print(f"Error processing file {file}: {e}")
-            continue
+    # Parse the files in parallel, one worker process per CPU by default.
+    # With a single worker the pool would only add pickling overhead, so parse in-process.
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext() as executor:
+        if executor is None:
+            parsed = map(_parse_one, files)
+        else:
+            # Large chunks keep the number of round trips to the workers low
+            chunksize = max(64, len(files) // (workers * 4))
+            parsed = executor.map(_parse_one, files, chunksize=chunksize)
+        for summary_row, results in tqdm(parsed, total=len(files)):
+            if summary_row is None:
+                continue
+            postal_codes.append(summary_row[0])
+            totalcounts.append(summary_row[1])
+            detail_rows.extend(results)
 
     # Create the two DataFrames
-    summary_df = pd.DataFrame(summary_rows)
+    summary_df = pd.DataFrame({
+        'postal_code': postal_codes,
+        'totalcount': np.fromiter(totalcounts, dtype=np.int64, count=len(totalcounts)),
+    })
+    detail_df = pd.DataFrame(detail_rows)
     
-    if not detail_rows:
+    return summary_df, detail_df
+
+def load_parquet_dataset(path):
+    """
+    Load scrape results from a Parquet dataset written by scrape-cpso.py
+    
+    Args:
+        path: Directory (or file) of the Parquet dataset
+        
+    Returns:
+        Tuple of (summary DataFrame, details DataFrame)
+    """
+    print(f"Reading Parquet dataset: {path}")
+    
+    df = pd.read_parquet(path, columns=['postal_code', 'doctor_type', 'last_name', 'totalcount', 'results'])
+    
+    # A search fetched again with --force is appended as a new row; keep only the newest one
+    df = df.drop_duplicates(subset=['postal_code', 'doctor_type', 'last_name'], keep='last')
+    summary_df = df[['postal_code', 'totalcount']].reset_index(drop=True)
+    
+    # Each row holds the JSON-encoded result list of one search
+    loads = orjson.loads if HAS_ORJSON else json.loads
+    records = [record for results in df['results'].dropna() for record in loads(results)]
+    detail_df = pd.DataFrame(records)
+    
+    return summary_df, detail_df
+
+def process_data(input_pattern=None, output_dir=None, workers=None, output_format="csv"):
+    """
+    Process scraping results and generate summary and detail outputs
+    
+    Args:
+        input_pattern: Glob pattern to find input JSON files, or the path of a
+            Parquet dataset written by scrape-cpso.py
+        output_dir: Directory where output files will be saved
+        workers: Number of processes used to parse files (defaults to the CPU count)
+        output_format: Format of the output files ("csv", "parquet" or "feather")
+    """
+    # Create output directory if it doesn't exist
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    if input_pattern and (os.path.isdir(input_pattern) or input_pattern.endswith('.parquet')):
+        summary_df, detail_df = load_parquet_dataset(input_pattern)
+    else:
+        summary_df, detail_df = load_json_files(input_pattern, workers)
+        if summary_df is None:
+            return
+    
+    detail_count = len(detail_df)
+    
+    if detail_df.empty:
         print("No detail records found")
-        detail_df = pd.DataFrame()
     else:
-        detail_df = pd.DataFrame(detail_rows)
+        if HAS_ARROW_DTYPES:
+            # Arrow-backed columns make deduplication and string cleanup run in C
+            detail_df = detail_df.convert_dtypes(dtype_backend='pyarrow')
         if 'cpsonumber' in detail_df.columns:
             detail_df = detail_df.drop_duplicates(subset=['cpsonumber'])
         
         # Apply phone formatting
         if 'phonenumber' in detail_df.columns:
-            detail_df['phonenumber'] = detail_df['phonenumber'].apply(format_phone)
+            detail_df['phonenumber'] = format_phone(detail_df['phonenumber'])
         if 'fax' in detail_df.columns:
-            detail_df['fax'] = detail_df['fax'].apply(format_phone)
+            detail_df['fax'] = format_phone(detail_df['fax'])
 
     # Find capped codes
     summary_df_capped = summary_df[
         (summary_df['totalcount'] == -1) &
-        (summary_df['postal_code'].apply(lambda x: len(str(x)) == 7))
+        (summary_df['postal_code'].astype('string').str.len() == 7).fillna(False)
     ]
     
     if not summary_df_capped.empty:
         print(f"Found {len(summary_df_capped)} capped postal codes")
     
     # Determine output file paths
-    summary_path = os.path.join(output_dir or RESULTS_DIR, "summary.csv")
-    details_path = os.path.join(output_dir or RESULTS_DIR, "details.csv")
+    summary_path = os.path.join(output_dir or RESULTS_DIR, f"summary.{output_format}")
+    details_path = os.path.join(output_dir or RESULTS_DIR, f"details.{output_format}")
     
-    # Save to CSVs
-    summary_df.to_csv(summary_path, index=False)
+    # Save outputs
+    save_dataframe(summary_df, summary_path, output_format)
     if not detail_df.empty:
-        detail_df.to_csv(details_path, index=False)
+        save_dataframe(detail_df, details_path, output_format)
     
     print(f"Saved summary to: {summary_path}")
     print(f"Saved details to: {details_path}")
-    print(f"Processed {len(summary_rows)} postal codes with {len(detail_rows)} doctor records")
+    print(f"Processed {len(summary_df)} postal codes with {detail_count} doctor records")
 
 def main():
     """Parse command-line arguments and run the processing"""
-    parser = argparse.ArgumentParser(description='Create summary and detail CSV outputs from CPSO scrape data')
+    parser = argparse.ArgumentParser(description='Create summary and detail outputs from CPSO scrape data')
     
     parser.add_argument('-i', '--input', 
-                        help='Glob pattern for input JSON files (e.g., "data/*/raw/*.json")')
+                        help='Glob pattern for input JSON files (e.g., "data/*/raw/*.json") '
+                             'or a Parquet dataset directory (e.g., "data/FSA_LDU1/parquet")')
     
     parser.add_argument('-o', '--output-dir',
-                        help='Directory to save CSV output files')
+                        help='Directory to save output files')
+    
+    parser.add_argument('-f', '--format', default='csv', choices=['csv', 'parquet', 'feather'],
+                        help='Format of the output files (default: csv)')
+    
+    parser.add_argument('-w', '--workers', type=int,
+                        help='Number of processes used to parse input files (default: number of CPUs)')
     
     args = parser.parse_args()
     
     # Process the data with provided arguments
-    process_data(input_pattern=args.input, output_dir=args.output_dir)
+    process_data(input_pattern=args.input, output_dir=args.output_dir, workers=args.workers,
+                 output_format=args.format)
 
 if __name__ == "__main__":
     main()
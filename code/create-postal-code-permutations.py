@@ -7,12 +7,57 @@ This script contains the core functions to generate different levels of postal c
 import os
 import json
 import string
-from tqdm import tqdm
+import itertools
+import numpy as np
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
 
 # Valid characters for Canadian postal codes
 VALID_LETTERS = [c for c in string.ascii_uppercase if c not in {'D', 'F', 'I', 'O', 'Q', 'U'}]
 VALID_DIGITS = list("0123456789")
 
+# Suffixes appended at each permutation level, and the output file name (without extension)
+LEVELS = {
+    'ldu1': (["+" + d for d in VALID_DIGITS], "FSA_LDU1"),  # Fourth position: Number
+    'ldu2': (VALID_LETTERS, "FSA_LDU2"),                    # Fifth position: Letter
+    'ldu3': (VALID_DIGITS, "FSA_LDU3"),                     # Sixth position: Number
+}
+
+def get_level(level):
+    """
+    Look up the suffixes and output file name for a permutation level
+    
+    Args:
+        level: Permutation level ('ldu1', 'ldu2', or 'ldu3')
+        
+    Returns:
+        Tuple of (list of suffixes, output file name without extension)
+    """
+    try:
+        return LEVELS[level.lower()]
+    except KeyError:
+        raise ValueError(f"Invalid level: {level}. Must be 'ldu1', 'ldu2', or 'ldu3'.") from None
+
+def append_suffixes(postal_codes, suffixes):
+    """
+    Append every suffix to every postal code
+    
+    Args:
+        postal_codes: List of postal code prefixes
+        suffixes: List of strings to append to each prefix
+        
+    Returns:
+        List of postal codes, grouped by prefix in input order
+    """
+    # Broadcast prefixes (column) against suffixes (row) so the concatenation runs in numpy
+    prefixes = np.asarray(postal_codes, dtype=str)[:, None]
+    suffixes = np.asarray(suffixes, dtype=str)[None, :]
+    return np.char.add(prefixes, suffixes).ravel().tolist()
+
 def generate_ldu1_permutations(postal_codes):
     """
     Generate postal code permutations with 1 character of LDU (4 characters total)
@@ -23,12 +68,7 @@ def generate_ldu1_permutations(postal_codes):
     Returns:
         List of 4-character postal codes (FSA+LDU1)
     """
-    all_permutations = []
-    for postal_code in tqdm(postal_codes):
-        # Fourth position: Number
-        all_permutations.extend([postal_code + "+" + d for d in VALID_DIGITS])
-    
-    return all_permutations
+    return append_suffixes(postal_codes, LEVELS['ldu1'][0])
 
 def generate_ldu2_permutations(postal_codes):
     """
@@ -40,12 +80,7 @@ def generate_ldu2_permutations(postal_codes):
     Returns:
         List of 5-character postal codes (FSA+LDU2)
     """
-    all_permutations = []
-    for postal_code in tqdm(postal_codes):
-        # Fifth position: Letter
-        all_permutations.extend([postal_code + l for l in VALID_LETTERS])
-    
-    return all_permutations
+    return append_suffixes(postal_codes, LEVELS['ldu2'][0])
 
 def generate_ldu3_permutations(postal_codes):
     """
@@ -57,20 +92,19 @@ def generate_ldu3_permutations(postal_codes):
     Returns:
         List of 6-character postal codes (full postal code)
     """
-    all_permutations = []
-    for postal_code in tqdm(postal_codes):
-        # Sixth position: Number
-        all_permutations.extend([postal_code + d for d in VALID_DIGITS])
-    
-    return all_permutations
+    return append_suffixes(postal_codes, LEVELS['ldu3'][0])
 
 def save_permutations(permutations, output_file):
     """
-    Save postal code permutations to a JSON file
+    Save postal code permutations to a file
+    
+    The format is picked from the file extension: .txt writes one postal code
+    per line, .parquet writes a single 'postal_code' column, and anything else
+    writes a JSON list.
     
     Args:
         permutations: List of postal code permutations
-        output_file: Path to the output JSON file
+        output_file: Path to the output file (.txt, .parquet or .json)
         
     Returns:
         True if successful, False otherwise
@@ -79,15 +113,27 @@ def save_permutations(permutations, output_file):
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
         
-        with open(output_file, 'w') as f:
-            json.dump(permutations, f)
+        if output_file.endswith('.txt'):
+            with open(output_file, 'w') as f:
+                f.write('\n'.join(permutations))
+                f.write('\n')
+        elif output_file.endswith('.parquet'):
+            import pandas as pd
+            
+            pd.DataFrame({'postal_code': permutations}).to_parquet(output_file, index=False, compression='zstd')
+        elif HAS_ORJSON:
+            with open(output_file, 'wb') as f:
+                f.write(orjson.dumps(permutations))
+        else:
+            with open(output_file, 'w') as f:
+                json.dump(permutations, f)
         print(f"Saved {len(permutations)} permutations to {output_file}")
         return True
     except Exception as e:
         print(f"Error saving permutations: {e}")
         return False
 
-def generate_and_save_permutations(postal_codes, level, output_dir="data/search-criteria"):
+def generate_and_save_permutations(postal_codes, level, output_dir="data/search-criteria", output_format="txt"):
     """
     Generate permutations for the specified level and save to a file
     
@@ -95,34 +141,54 @@ def generate_and_save_permutations(postal_codes, level, output_dir="data/search-
         postal_codes: List of postal codes to generate permutations from
         level: Permutation level ('ldu1', 'ldu2', or 'ldu3')
         output_dir: Directory to save the output file
+        output_format: Output file format ('txt', 'parquet', or 'json')
         
     Returns:
         List of generated permutations
     """
-    if level.lower() == 'ldu1':
-        permutations = generate_ldu1_permutations(postal_codes)
-        filename = "FSA_LDU1.json"
-    elif level.lower() == 'ldu2':
-        permutations = generate_ldu2_permutations(postal_codes)
-        filename = "FSA_LDU2.json"
-    elif level.lower() == 'ldu3':
-        permutations = generate_ldu3_permutations(postal_codes)
-        filename = "FSA_LDU3.json"
-    else:
-        raise ValueError(f"Invalid level: {level}. Must be 'ldu1', 'ldu2', or 'ldu3'.")
+    suffixes, filename = get_level(level)
+    permutations = append_suffixes(postal_codes, suffixes)
     
-    output_file = os.path.join(output_dir, filename)
+    output_file = os.path.join(output_dir, f"{filename}.{output_format}")
     save_permutations(permutations, output_file)
     
     return permutations
 
+def generate_and_save_streaming(postal_codes, level, output_dir="data/search-criteria"):
+    """
+    Generate permutations for the specified level and write them straight to a text file
+    
+    Unlike generate_and_save_permutations, the permutations are never held in
+    memory as a list; each one is written as soon as it is produced.
+    
+    Args:
+        postal_codes: List of postal codes to generate permutations from
+        level: Permutation level ('ldu1', 'ldu2', or 'ldu3')
+        output_dir: Directory to save the output file
+        
+    Returns:
+        Number of permutations written
+    """
+    suffixes, filename = get_level(level)
+    
+    output_file = os.path.join(output_dir, f"{filename}.txt")
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # Use a large write buffer so lines are flushed in blocks
+    with open(output_file, 'w', buffering=1 << 20) as f:
+        f.writelines(f"{postal_code}{suffix}\n" for postal_code, suffix in itertools.product(postal_codes, suffixes))
+    
+    count = len(postal_codes) * len(suffixes)
+    print(f"Saved {count} permutations to {output_file}")
+    return count
+
 def load_postal_codes(input_file):
     """
-    Load postal codes from an input file (JSON or CSV)
+    Load postal codes from an input file (JSON, CSV, Parquet, Feather or text)
     Filters to only include postal_codes with totalcount = -1
     
     Args:
-        input_file: Path to the input file (JSON or CSV)
+        input_file: Path to the input file (JSON, CSV, Parquet, Feather or text with one code per line)
         
     Returns:
         List of postal codes where totalcount = -1
@@ -131,8 +197,8 @@ def load_postal_codes(input_file):
     
     try:
         if input_file.endswith('.json'):
-            with open(input_file, 'r') as f:
-                data = json.load(f)
+            with open(input_file, 'rb') as f:
+                data = orjson.loads(f.read()) if HAS_ORJSON else json.load(f)
                 # If JSON format contains totalcount, filter accordingly
                 postal_codes = []
                 for item in data:
@@ -140,8 +206,13 @@ def load_postal_codes(input_file):
                         postal_codes.append(item.get('postal_code'))
                     else:
                         postal_codes = data  # If simple list format, use as is
-        elif input_file.endswith('.csv'):
-            df = pd.read_csv(input_file)
+        elif input_file.endswith(('.csv', '.parquet', '.feather')):
+            if input_file.endswith('.csv'):
+                df = pd.read_csv(input_file)
+            elif input_file.endswith('.parquet'):
+                df = pd.read_parquet(input_file)
+            else:
+                df = pd.read_feather(input_file)
             if 'postal_code' in df.columns and 'totalcount' in df.columns:
                 # Filter to rows where totalcount is -1
                 filtered_df = df[df['totalcount'] == -1]
@@ -154,8 +225,12 @@ def load_postal_codes(input_file):
                 else:
                     # Use the first column if 'postal_code' doesn't exist
                     postal_codes = df.iloc[:, 0].tolist()
+        elif input_file.endswith('.txt'):
+            # Simple text file with one code per line
+            with open(input_file, 'r') as f:
+                postal_codes = [line.strip() for line in f if line.strip()]
         else:
-            raise ValueError(f"Unsupported file format: {input_file}. Must be .json or .csv")
+            raise ValueError(f"Unsupported file format: {input_file}. Must be .json, .csv, .parquet, .feather or .txt")
         
         print(f"Loaded {len(postal_codes)} postal codes with totalcount = -1 from {input_file}")
         return postal_codes
@@ -165,18 +240,26 @@ def load_postal_codes(input_file):
 
 if __name__ == "__main__":
     import argparse
+    import pandas as pd
     
     # Set up command line arguments
     parser = argparse.ArgumentParser(description='Generate postal code permutations for CPSO scraper')
     parser.add_argument('level', type=int, choices=[1, 2, 3], 
                         help='LDU level to generate (1=4th char, 2=5th char, 3=6th char)')
     parser.add_argument('--input_file', default='results/summary.csv',
-                        help='Path to input file containing postal codes (JSON or CSV)')
+                        help='Path to input file containing postal codes (JSON, CSV, Parquet, Feather or text)')
     parser.add_argument('--output-dir', default='data/search-criteria',
                         help='Directory to save output files (default: data/search-criteria)')
+    parser.add_argument('--output-format', default='txt', choices=['txt', 'parquet', 'json'],
+                        help='Format of the output file (default: txt, one postal code per line)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Write permutations to the text file as they are generated instead of building a list first')
     
     args = parser.parse_args()
     
+    if args.streaming and args.output_format != 'txt':
+        parser.error("--streaming only supports --output-format txt")
+    
     # Load postal codes from input file
     postal_codes = load_postal_codes(args.input_file)
     
@@ -193,14 +276,9 @@ if __name__ == "__main__":
     required_length = required_length_map[args.level]
     
     # Filter postal codes by their true length (excluding '+' characters)
-    filtered_postal_codes = []
-    for code in postal_codes:
-        # Remove '+' characters when calculating length
-        actual_length = len(code.replace('+', ''))
-        if actual_length == required_length:
-            filtered_postal_codes.append(code)
-    
-    postal_codes = filtered_postal_codes
+    codes = pd.Series(postal_codes, dtype='string')
+    actual_length = codes.str.len() - codes.str.count(r'\+')
+    postal_codes = codes[(actual_length == required_length).fillna(False)].tolist()
     
     print(f"Filtered to {len(postal_codes)} postal codes with length {required_length} (excluding '+' characters)")
     
@@ -214,10 +292,14 @@ if __name__ == "__main__":
     level = level_map[args.level]
     
     # Generate and save permutations
-    permutations = generate_and_save_permutations(
-        postal_codes,
-        level,
-        args.output_dir
-    )
+    if args.streaming:
+        count = generate_and_save_streaming(postal_codes, level, args.output_dir)
+    else:
+        count = len(generate_and_save_permutations(
+            postal_codes,
+            level,
+            args.output_dir,
+            args.output_format
+        ))
     
-    print(f"Generated {len(permutations)} permutations for LDU level {args.level}")
\ No newline at end of file
+    print(f"Generated {count} permutations for LDU level {args.level}")
\ No newline at end of file
@@ -5,102 +5,315 @@ import time
 import random
 import sys
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import unquote_plus
 
-def fetch_results_with_rate_limit(postal_codes, doctor_type="Any", last_name="Any", delay_range=(2, 5), output_dir="data"):
+from cpso_common import coerce_count
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+# Page that hands out the session cookies required by the search endpoint
+ADVANCED_SEARCH_URL = "https://register.cpso.on.ca/Advanced-Search/"
+# Refresh the session cookies after this many seconds
+COOKIE_TTL = 10 * 60
+
+SEARCH_URL = "https://register.cpso.on.ca/Get-Search-Results/"
+
+# Number of searches buffered before they are appended to the Parquet dataset
+PARQUET_BATCH_SIZE = 500
+
+HEADERS = {
+    "accept": "*/*",
+    "accept-language": "fr-CA,fr;q=0.9,en-CA;q=0.8,en-US;q=0.7,en;q=0.6",
+    "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
+    "priority": "u=1, i",
+    "sec-ch-ua": "\"Google Chrome\";v=\"135\", \"Not-A.Brand\";v=\"8\", \"Chromium\";v=\"135\"",
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": "\"Windows\"",
+    "sec-fetch-dest": "empty",
+    "sec-fetch-mode": "cors",
+    "sec-fetch-site": "same-origin",
+    "x-requested-with": "XMLHttpRequest",
+    "User-Agent": "CPSO Registry Scraper (+https://github.com/yourusername/cpso-doctor-registry-scraper)"
+}
+
+def build_search_form(postal_code, doctor_type="Any", last_name="Any"):
+    """
+    Build the form fields for a search request
+    
+    Postal codes, doctor types and last names use '+' for spaces (e.g.
+    "K1A+2", "Family+Doctor"), as in a form-encoded body. They are decoded
+    here so requests can encode the form itself.
+    
+    Args:
+        postal_code: Postal code to search
+        doctor_type: Type of doctor to search for ("Any", "Family+Doctor", "Specialist")
+        last_name: Last name to filter by ("Any" ignores this field)
+        
+    Returns:
+        Dict of form fields
+    """
+    form = {"cbx-includeinactive": "on"}
+    # The last name filter is only sent along with a specific doctor type
+    if doctor_type != "Any" and last_name != "Any":
+        form["lastName"] = unquote_plus(last_name)
+    form["postalCode"] = unquote_plus(postal_code)
+    form["doctorType"] = unquote_plus(doctor_type)
+    if doctor_type == "Specialist":
+        form["SpecialistType"] = "Psychiatry"
+    return form
+
+def result_filename(output_dir, postal_code, doctor_type="Any", last_name="Any"):
+    """Return the path of the raw JSON file for a search"""
+    return os.path.join(output_dir, "raw", f"{postal_code}+{doctor_type}+{last_name}.json")
+
+def dataset_dirname(output_dir):
+    """Return the directory of the Parquet dataset for a scrape"""
+    return os.path.join(output_dir, "parquet")
+
+def load_scraped_postal_codes(dataset_dir, doctor_type="Any", last_name="Any"):
+    """
+    Get the postal codes already saved in a Parquet dataset for a search
+    
+    Args:
+        dataset_dir: Directory of the Parquet dataset
+        doctor_type: Type of doctor searched for
+        last_name: Last name filter of the search
+        
+    Returns:
+        Set of postal codes
+    """
+    import pandas as pd
+    
+    if not os.path.isdir(dataset_dir):
+        return set()
+    
+    df = pd.read_parquet(dataset_dir, columns=['postal_code', 'doctor_type', 'last_name'])
+    searched = df[(df['doctor_type'] == doctor_type) & (df['last_name'] == last_name)]
+    return set(searched['postal_code'])
+
+def save_results_to_dataset(results, dataset_dir, doctor_type="Any", last_name="Any"):
+    """
+    Append search results to a Parquet dataset partitioned by doctor type
+    
+    Each search becomes one row; its list of doctors is stored as JSON text so
+    the schema does not depend on which fields the registry returns.
+    
+    Args:
+        results: List of result data, each with a postal_code key
+        dataset_dir: Directory of the Parquet dataset
+        doctor_type: Type of doctor searched for
+        last_name: Last name filter of the search
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    dumps = (lambda obj: orjson.dumps(obj).decode()) if HAS_ORJSON else json.dumps
+    table = pa.table({
+        'postal_code': pa.array([result['postal_code'] for result in results], pa.string()),
+        'doctor_type': pa.array([doctor_type] * len(results), pa.string()),
+        'last_name': pa.array([last_name] * len(results), pa.string()),
+        'totalcount': pa.array([coerce_count(result.get('totalcount')) for result in results], pa.int64()),
+        'results': pa.array([dumps(result.get('results', [])) for result in results], pa.string()),
+    })
+    # Timestamped file names sort in write order, so readers can tell which row of a repeated search is newest
+    pq.write_to_dataset(table, root_path=dataset_dir, partition_cols=['doctor_type'],
+                        basename_template=f"part-{time.time_ns():020d}-{{i}}.parquet")
+    
+    print(f"Saved {len(results)} results to {dataset_dir}")
+
+def fetch_results_with_rate_limit(postal_codes, doctor_type="Any", last_name="Any", delay_range=(2, 5), output_dir="data", concurrency=8, force=False, pretty=False, output_format="json", max_rate=4.0):
     """
     Fetch results from CPSO registry with rate limiting
     
+    Requests are spread over a pool of worker threads. Each worker still waits
+    a random delay before its request, so the polite delays overlap instead of
+    adding up, and all workers together stay under max_rate requests per
+    second. Each worker keeps its own session, so connections and cookies are
+    reused across postal codes. Postal codes that already have saved results
+    are skipped unless force is set.
+    
+    With output_format "json" each search is saved to its own file in
+    output_dir/raw. With "parquet" searches are appended in batches to a
+    single dataset in output_dir/parquet (requires pyarrow).
+    
     Args:
         postal_codes: List of postal codes to search
         doctor_type: Type of doctor to search for ("Any", "Family+Doctor", "Specialist")
         last_name: Last name to filter by ("Any" ignores this field)
         delay_range: Tuple defining min and max delay between requests
         output_dir: Directory to save results
+        concurrency: Maximum number of requests in flight at once
+        force: Fetch every postal code, even if its results file already exists
+        pretty: Indent the saved JSON files for human reading
+        output_format: How to save results ("json" or "parquet")
+        max_rate: Maximum number of requests per second across all workers
         
     Returns:
         List of result data
     """
-    all_results = []
+    dataset_dir = dataset_dirname(output_dir)
     
-    for postal_code in postal_codes:
+    # Only fetch postal codes that were not scraped by a previous run
+    if not force:
+        if output_format == "parquet":
+            scraped = load_scraped_postal_codes(dataset_dir, doctor_type, last_name)
+            pending = [pc for pc in postal_codes if pc not in scraped]
+        else:
+            pending = [pc for pc in postal_codes if not os.path.exists(result_filename(output_dir, pc, doctor_type, last_name))]
+        if len(pending) < len(postal_codes):
+            print(f"Skipping {len(postal_codes) - len(pending)} postal codes that already have results (use --force to fetch them again)")
+        postal_codes = pending
+        if not postal_codes:
+            return []
+
+    # Each worker thread gets its own session, warmed up once and kept for the whole run
+    local = threading.local()
+    sessions = []
+    sessions_lock = threading.Lock()
+
+    # Space out requests across all workers to stay under max_rate
+    rate_lock = threading.Lock()
+    next_request_at = 0.0
+
+    def wait_for_rate_limit():
+        """Block until another request can be sent without exceeding max_rate"""
+        nonlocal next_request_at
+        with rate_lock:
+            now = time.monotonic()
+            wait = next_request_at - now
+            next_request_at = max(now, next_request_at) + 1 / max_rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def get_session():
+        """Return this worker's session, visiting the search page if its cookies are missing or older than COOKIE_TTL"""
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.cookies_fetched_at = None
+            with sessions_lock:
+                sessions.append(local.session)
+        if (local.cookies_fetched_at is None or not local.session.cookies
+                or time.monotonic() - local.cookies_fetched_at >= COOKIE_TTL):
+            wait_for_rate_limit()
+            local.session.get(ADVANCED_SEARCH_URL)
+            local.cookies_fetched_at = time.monotonic()
+        return local.session
+
+    def fetch_one(postal_code):
         # Random delay between requests
         delay = random.uniform(delay_range[0], delay_range[1])
         time.sleep(delay)
         
         print(f"Fetching results for postal code={postal_code}; physician type={doctor_type}; last name={last_name}...")
 
-        url = "https://register.cpso.on.ca/Get-Search-Results/"
-
-        headers = {
-            "accept": "*/*",
-            "accept-language": "fr-CA,fr;q=0.9,en-CA;q=0.8,en-US;q=0.7,en;q=0.6",
-            "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
-            "priority": "u=1, i",
-            "sec-ch-ua": "\"Google Chrome\";v=\"135\", \"Not-A.Brand\";v=\"8\", \"Chromium\";v=\"135\"",
-            "sec-ch-ua-mobile": "?0",
-            "sec-ch-ua-platform": "\"Windows\"",
-            "sec-fetch-dest": "empty",
-            "sec-fetch-mode": "cors",
-            "sec-fetch-site": "same-origin",
-            "x-requested-with": "XMLHttpRequest",
-            "User-Agent": "CPSO Registry Scraper (+https://github.com/yourusername/cpso-doctor-registry-scraper)"
-        }
-
-        if doctor_type == "Any":
-            body = "cbx-includeinactive=on&postalCode={}&doctorType={}".format(postal_code, doctor_type)
-        elif (doctor_type == "Family+Doctor") & (last_name == "Any"):
-            body = "cbx-includeinactive=on&postalCode={}&doctorType={}".format(postal_code, doctor_type)
-        elif (doctor_type == "Specialist") & (last_name == "Any"):
-            body = "cbx-includeinactive=on&postalCode={}&doctorType={}&SpecialistType={}".format(postal_code, doctor_type, "Psychiatry")
-        elif (doctor_type == "Family+Doctor") & (last_name != "Any"):
-            body = "cbx-includeinactive=on&lastName={}&postalCode={}&doctorType={}".format(last_name, postal_code, doctor_type)
-        elif (doctor_type == "Specialist") & (last_name != "Any"):
-            body = "cbx-includeinactive=on&lastName={}&postalCode={}&doctorType={}&SpecialistType={}".format(last_name, postal_code, doctor_type, "Psychiatry")
-
-        session = requests.Session()
-        session.get("https://register.cpso.on.ca/Advanced-Search/")
-
-        result_data = fetch_with_backoff(url, body, headers, session)
+        form = build_search_form(postal_code, doctor_type, last_name)
+        session = get_session()
+        result_data = fetch_with_backoff(SEARCH_URL, form, HEADERS, session, wait_for_rate_limit=wait_for_rate_limit)
         
         if result_data:
             # Add the postal code to the top level of the JSON
             result_data["postal_code"] = postal_code
-            all_results.append(result_data)
             print(f"Retrieved {len(result_data.get('results', []))} results for {postal_code}+{doctor_type}+{last_name}")
 
+            if output_format == "parquet":
+                # Batched and written by the main thread
+                return result_data
+
             # Ensure output directory exists
             os.makedirs(os.path.join(output_dir, "raw"), exist_ok=True)
             
             # Save results to file
-            filename = os.path.join(output_dir, "raw", f"{postal_code}+{doctor_type}+{last_name}.json")
-            save_results_to_file(result_data, filename=filename)
+            filename = result_filename(output_dir, postal_code, doctor_type, last_name)
+            save_results_to_file(result_data, filename=filename, pretty=pretty)
+
+        return result_data
+
+    all_results = []
+    batch = []
+    
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for result in executor.map(fetch_one, postal_codes):
+                if not result:
+                    continue
+                all_results.append(result)
+                if output_format == "parquet":
+                    batch.append(result)
+                    if len(batch) >= PARQUET_BATCH_SIZE:
+                        save_results_to_dataset(batch, dataset_dir, doctor_type, last_name)
+                        batch = []
+    finally:
+        # Keep what was fetched even if the run is interrupted
+        if batch:
+            save_results_to_dataset(batch, dataset_dir, doctor_type, last_name)
+        for session in sessions:
+            session.close()
     
     return all_results
 
-def fetch_with_backoff(url, body, headers, session, max_retries=5, initial_delay=2):
-    """Make a request with exponential backoff for rate limiting"""
+def fetch_with_backoff(url, body, headers, session, max_retries=5, initial_delay=2, max_delay=60, wait_for_rate_limit=None):
+    """
+    Make a request, backing off when the server is rate limiting or failing
+    
+    429 responses wait for the server's Retry-After (or the current delay,
+    whichever is longer) and double the delay. 5xx and other error responses
+    wait the current delay and grow it more gently. Connection errors and
+    timeouts are retried straight away. Every wait gets random jitter so
+    concurrent workers do not retry in lockstep. If wait_for_rate_limit is
+    given it is called before every attempt, retries included.
+    
+    Args:
+        url: URL to post to
+        body: Form fields of the request
+        headers: Request headers
+        session: requests.Session to send the request with
+        max_retries: Number of attempts before giving up
+        initial_delay: First backoff delay in seconds
+        max_delay: Upper bound for the backoff delay in seconds
+        wait_for_rate_limit: Optional function that blocks until a request may be sent
+        
+    Returns:
+        The decoded JSON response, or None if the request failed
+    """
     retries = 0
     delay = initial_delay
     
     while retries < max_retries:
+        if wait_for_rate_limit:
+            wait_for_rate_limit()
         try:
             # Use allow_redirects=True to follow any redirects
-            # Use cookies=True to maintain session cookies
+            # Cookies come from the session's jar, which is reused across requests
             response = session.post(
                 url, 
                 headers=headers, 
                 data=body, 
-                allow_redirects=True,
-                cookies=requests.cookies.RequestsCookieJar()  # Initialize an empty cookie jar
+                allow_redirects=True
             )
                         
             if response.status_code == 200:
                 return response.json()
             elif response.status_code == 429:  # Too Many Requests
-                print(f"Rate limited. Backing off for {delay} seconds...")
+                # Honor the server's Retry-After header when it gives a number of seconds
+                retry_after = response.headers.get("Retry-After", "")
+                wait = max(delay, int(retry_after)) if retry_after.isdigit() else delay
+                delay = min(delay * 2, max_delay)
+                print(f"Rate limited. Backing off for {wait} seconds...")
             else:
                 print(f"Error: Status code {response.status_code}")
+                wait = delay
+                delay = min(delay * 1.5, max_delay)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            # Transient network problem, retry right away
+            print(f"Request failed: {e}")
+            wait = 0
         except Exception as e:
             print(f"Request failed: {e}")
 
@@ -108,27 +321,36 @@ def fetch_with_backoff(url, body, headers, session, max_retries=5, initial_delay
             if "Invalid control character at: line" in str(e):
                 print("Skipping response with invalid control character")
                 return None
+            
+            wait = delay
+            delay = min(delay * 2, max_delay)
         
-        # Exponential backoff
-        time.sleep(delay)
-        delay *= 2  # Double the delay each time
+        # Jittered backoff
+        time.sleep(wait + random.uniform(0, 0.5 * wait))
         retries += 1
         print(f"Retrying... attempt {retries}/{max_retries}")
     
     print("Max retries reached. Giving up.")
     return None
 
-def save_results_to_file(results, filename="cpso_results.json"):
-    """Save results to a JSON file"""
+def save_results_to_file(results, filename="cpso_results.json", pretty=False):
+    """Save results to a JSON file, compact unless pretty is set"""
     # Create directory if it doesn't exist
     os.makedirs(os.path.dirname(filename), exist_ok=True)
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2)
+    if HAS_ORJSON:
+        with open(filename, 'wb') as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2 if pretty else None))
+    else:
+        with open(filename, 'w', encoding='utf-8') as f:
+            if pretty:
+                json.dump(results, f, indent=2)
+            else:
+                json.dump(results, f, separators=(',', ':'))
     
     print(f"Results saved to {filename}")
 
-def run_simple_scrape(postal_codes, output_dir="data", doctor_type="Any", last_name="Any"):
+def run_simple_scrape(postal_codes, output_dir="data", doctor_type="Any", last_name="Any", concurrency=8, force=False, pretty=False, output_format="json", max_rate=4.0):
     """
     Run a simple scrape with the provided postal codes
     
@@ -137,12 +359,22 @@ def run_simple_scrape(postal_codes, output_dir="data", doctor_type="Any", last_n
         output_dir: Directory to save results
         doctor_type: Type of doctor to search for ("Any", "Family+Doctor", "Specialist")
         last_name: Last name to filter by ("Any" ignores this field)
+        concurrency: Maximum number of requests in flight at once
+        force: Fetch every postal code, even if its results file already exists
+        pretty: Indent the saved JSON files for human reading
+        output_format: How to save results ("json" or "parquet")
+        max_rate: Maximum number of requests per second across all workers
     """
     results = fetch_results_with_rate_limit(
         postal_codes, 
         doctor_type=doctor_type,
         last_name=last_name,
-        output_dir=output_dir
+        output_dir=output_dir,
+        concurrency=concurrency,
+        force=force,
+        pretty=pretty,
+        output_format=output_format,
+        max_rate=max_rate
     )
     
     # Print summary
@@ -155,7 +387,7 @@ def load_postal_codes_from_file(input_file):
     Load postal codes from a file
     
     Args:
-        input_file: Path to the input file (JSON or CSV)
+        input_file: Path to the input file (JSON, CSV, Parquet or text)
         
     Returns:
         List of postal codes
@@ -164,8 +396,8 @@ def load_postal_codes_from_file(input_file):
     
     try:
         if input_file.endswith('.json'):
-            with open(input_file, 'r') as f:
-                data = json.load(f)
+            with open(input_file, 'rb') as f:
+                data = orjson.loads(f.read()) if HAS_ORJSON else json.load(f)
                 if isinstance(data, list):
                     return data
                 elif isinstance(data, dict) and 'postal_code' in data:
@@ -173,8 +405,11 @@ def load_postal_codes_from_file(input_file):
                 else:
                     print(f"Unexpected JSON structure in {input_file}")
                     return []
-        elif input_file.endswith('.csv'):
-            df = pd.read_csv(input_file)
+        elif input_file.endswith(('.csv', '.parquet')):
+            if input_file.endswith('.csv'):
+                df = pd.read_csv(input_file)
+            else:
+                df = pd.read_parquet(input_file)
             if 'postal_code' in df.columns:
                 return df['postal_code'].tolist()
             else:
@@ -200,9 +435,24 @@ if __name__ == "__main__":
                        help='Type of doctor to search for (default: Any)')
     parser.add_argument('--last-name', '-l', default="Any",
                        help='Last name to filter by (default: Any)')
+    parser.add_argument('--concurrency', '-c', type=int, default=8,
+                       help='Number of requests to run in parallel (default: 8)')
+    parser.add_argument('--max-rate', type=float, default=4.0,
+                       help='Maximum number of requests per second across all workers (default: 4)')
+    parser.add_argument('--force', action='store_true',
+                       help='Fetch postal codes again even if their results file already exists')
+    parser.add_argument('--pretty', action='store_true',
+                       help='Indent the saved JSON files (default: compact)')
+    parser.add_argument('--output-format', '-f', default="json", choices=["json", "parquet"],
+                       help='Save one JSON file per postal code, or append to a single Parquet dataset (default: json)')
     
     args = parser.parse_args()
     
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.max_rate <= 0:
+        parser.error("--max-rate must be greater than 0")
+    
     # Validate input file exists
     if not os.path.exists(args.input_file):
         print(f"Error: Input file '{args.input_file}' not found.")
@@ -226,11 +476,17 @@ if __name__ == "__main__":
     print(f"Doctor type: {args.doctor_type}")
     print(f"Last name filter: {args.last_name}")
     print(f"Output will be saved to: {args.output_dir}")
+    print(f"Concurrency: {args.concurrency} (at most {args.max_rate} requests per second)")
     
     # Run the scrape
     run_simple_scrape(
         postal_codes, 
         args.output_dir,
         doctor_type=args.doctor_type,
-        last_name=args.last_name
+        last_name=args.last_name,
+        concurrency=args.concurrency,
+        force=args.force,
+        pretty=args.pretty,
+        output_format=args.output_format,
+        max_rate=args.max_rate
     )
\ No newline at end of file
@@ -9,6 +9,15 @@ import itertools
 import string
 import pandas as pd
 
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+# Strings that look like a FSA i.e. letter number letter
+FSA_PATTERN = re.compile(r"[A-Z][0-9][A-Z]")
+
 def fetch_forward_sortation_areas_with_delay(urls, delay_range=(2, 5)):
 
     all_results = []
@@ -31,12 +40,11 @@ def fetch_forward_sortation_areas_with_delay(urls, delay_range=(2, 5)):
 def fetch_FSA(url):
 
     r = requests.get(url)
-    soup = BeautifulSoup(r.content, 'html.parser')
-    b_tags = soup.find_all("b")
+    soup = BeautifulSoup(r.content, 'lxml')
+    b_texts = (tag.get_text() for tag in soup.find_all("b"))
 
-    # keep only strings that look like a FSA i.e. letter number letter
-    pattern = re.compile("[A-Z][0-9][A-Z]")
-    b_tags_filtered = [tag.get_text() for tag in b_tags if pattern.match(tag.get_text())]
+    # keep only strings that look like a FSA
+    b_tags_filtered = [text for text in b_texts if FSA_PATTERN.match(text)]
 
     return b_tags_filtered
 
@@ -44,8 +52,12 @@ def save_results_to_file(results, filename="data/search-criteria/FSA_LDU0.json")
     """Save results to a JSON file"""
     import json
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2)
+    if HAS_ORJSON:
+        with open(filename, 'wb') as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+    else:
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
     
     print(f"Results saved to {filename}")
 